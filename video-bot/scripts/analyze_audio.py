@@ -1,23 +1,44 @@
 #!/usr/bin/env python3
 """
-Analyze audio with Hume Batch API and return speaker segments including gender.
+Analyze audio and return speaker segments including gender.
+
+Two backends share this entry point: "hume" (Hume Batch API, the default) and
+"pyannote" (local diarization from speaker_diarization.py). The heavy pyannote
+stack is imported only when that backend is selected.
 """
 
 from __future__ import annotations
 
-import json
+import argparse
+import asyncio
+import heapq
+import importlib.util
 import os
 import sys
 import time
 import traceback
+from functools import lru_cache
+from operator import itemgetter
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import TYPE_CHECKING, Any, Dict, List, Literal, Optional, Sequence
+
+import orjson
 
-import requests
+if TYPE_CHECKING:
+    import aiohttp
+
+Backend = Literal["hume", "pyannote"]
+BACKENDS = ("hume", "pyannote")
 
 HUME_BATCH_URL = "https://api.hume.ai/v0/batch/jobs"
-POLL_INTERVAL_SECONDS = 5
+POLL_INITIAL_SECONDS = 1.0
+POLL_MAX_SECONDS = 15.0
+POLL_BACKOFF_FACTOR = 1.5
 POLL_TIMEOUT_SECONDS = 15 * 60  # 15 minutes being generous for long clips
+MAX_CONNECTIONS = 4
+RETRY_ATTEMPTS = 3
+RETRY_BACKOFF_SECONDS = 0.5
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
 
 
 def _env(name: str) -> str:
@@ -27,46 +48,74 @@ def _env(name: str) -> str:
     return value
 
 
-def _submit_job(audio_path: Path, api_key: str) -> str:
-    with audio_path.open("rb") as audio_file:
-        files = {"file": (audio_path.name, audio_file, "audio/wav")}
-        payload = {
-            "models": {
-                "prosody": {
-                    "identify_speakers": True,
-                },
+async def _submit_job(session: aiohttp.ClientSession, audio_path: Path, api_key: str) -> str:
+    payload = {
+        "models": {
+            "prosody": {
+                "identify_speakers": True,
             },
-        }
+        },
+    }
+    with audio_path.open("rb") as audio_file:
+        # Passing the file object lets aiohttp stream the multipart body in chunks
+        # instead of holding the whole recording in memory.
+        form = aiohttp.FormData()
+        form.add_field("json", orjson.dumps(payload).decode())
+        form.add_field("file", audio_file, filename=audio_path.name, content_type="audio/wav")
 
-        response = requests.post(
+        async with session.post(
             HUME_BATCH_URL,
             headers={"X-Hume-Api-Key": api_key},
-            data={"json": json.dumps(payload)},
-            files=files,
-            timeout=60,
-        )
-    response.raise_for_status()
-    job = response.json()
+            data=form,
+            # No overall cap: a large file on a slow uplink may take minutes to stream.
+            # Like requests' timeout=60, only connecting and each socket read are bounded.
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=60, sock_read=60),
+        ) as response:
+            response.raise_for_status()
+            job = orjson.loads(await response.read())
     job_id = job.get("job_id")
     if not job_id:
         raise RuntimeError(f"Hume response missing job_id: {job}")
     return job_id
 
 
-def _poll_job(job_id: str, api_key: str) -> Dict[str, Any]:
+async def _get_json(session: aiohttp.ClientSession, url: str, api_key: str) -> Dict[str, Any]:
+    # GETs are idempotent, so transient connection errors and 429/5xx are retried with backoff.
+    attempt = 0
+    while True:
+        last_attempt = attempt == RETRY_ATTEMPTS
+        try:
+            async with session.get(
+                url,
+                headers={"X-Hume-Api-Key": api_key},
+                timeout=aiohttp.ClientTimeout(total=30),
+            ) as response:
+                if last_attempt or response.status not in RETRY_STATUSES:
+                    response.raise_for_status()
+                    return orjson.loads(await response.read())
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+            if last_attempt:
+                raise
+        await asyncio.sleep(RETRY_BACKOFF_SECONDS * (2 ** attempt))
+        attempt += 1
+
+
+async def _poll_job(session: aiohttp.ClientSession, job_id: str, api_key: str) -> Dict[str, Any]:
     deadline = time.time() + POLL_TIMEOUT_SECONDS
     status_url = f"{HUME_BATCH_URL}/{job_id}"
 
+    delay = POLL_INITIAL_SECONDS
+
     while time.time() < deadline:
-        response = requests.get(status_url, headers={"X-Hume-Api-Key": api_key}, timeout=30)
-        response.raise_for_status()
-        job = response.json()
+        job = await _get_json(session, status_url, api_key)
         status = job.get("state", {}).get("status")
         if status == "COMPLETED":
             return job
         if status in {"FAILED", "CANCELED"}:
             raise RuntimeError(f"Hume job {job_id} failed: {job}")
-        time.sleep(POLL_INTERVAL_SECONDS)
+        # Short clips finish quickly; back off so long jobs are not polled every few seconds.
+        await asyncio.sleep(min(delay, max(deadline - time.time(), 0.0)))
+        delay = min(delay * POLL_BACKOFF_FACTOR, POLL_MAX_SECONDS)
 
     raise TimeoutError(f"Hume job {job_id} polling timed out after {POLL_TIMEOUT_SECONDS} seconds")
 
@@ -78,7 +127,7 @@ def _extract_results(job: Dict[str, Any]) -> Dict[str, Any]:
         raise RuntimeError(f"Hume job missing results: {job}")
 
     speakers: Dict[str, Dict[str, str]] = {}
-    segments: List[Dict[str, Any]] = []
+    segment_runs: List[List[Dict[str, Any]]] = []
 
     for result in results:
         prosody_predictions = (
@@ -101,12 +150,14 @@ def _extract_results(job: Dict[str, Any]) -> Dict[str, Any]:
             if speaker_id not in speakers:
                 speakers[speaker_id] = {"gender": gender or "unknown"}
 
+            run: List[Dict[str, Any]] = []
+            segment_runs.append(run)
             for chunk in prediction.get("predictions", []):
                 start = chunk.get("time", {}).get("start")
                 end = chunk.get("time", {}).get("end")
                 if start is None or end is None:
                     continue
-                segments.append(
+                run.append(
                     {
                         "speaker": speaker_id,
                         "start": round(float(start), 3),
@@ -116,7 +167,7 @@ def _extract_results(job: Dict[str, Any]) -> Dict[str, Any]:
                     }
                 )
 
-    segments.sort(key=lambda s: s["start"])
+    segments = list(heapq.merge(*segment_runs, key=itemgetter("start")))
 
     return {
         "speakers": speakers,
@@ -124,7 +175,7 @@ def _extract_results(job: Dict[str, Any]) -> Dict[str, Any]:
     }
 
 
-def analyze_audio(file_path: str) -> Dict[str, Any]:
+async def _analyze_one(session: aiohttp.ClientSession, file_path: str) -> Dict[str, Any]:
     debug: Dict[str, Any] = {}
     try:
         api_key = _env("HUME_API_KEY")
@@ -132,9 +183,9 @@ def analyze_audio(file_path: str) -> Dict[str, Any]:
         if not path.exists():
             raise FileNotFoundError(f"Audio file does not exist: {file_path}")
 
-        job_id = _submit_job(path, api_key)
+        job_id = await _submit_job(session, path, api_key)
         debug["jobId"] = job_id
-        job = _poll_job(job_id, api_key)
+        job = await _poll_job(session, job_id, api_key)
         result = _extract_results(job)
         result["debug"] = debug
         return result
@@ -148,9 +199,85 @@ def analyze_audio(file_path: str) -> Dict[str, Any]:
         }
 
 
+async def analyze_audio_batch(file_paths: Sequence[str]) -> List[Dict[str, Any]]:
+    """Submit every file up front and wait for all Hume jobs concurrently."""
+    # aiohttp is only needed by the Hume backend: bind the module-level name here, on first use,
+    # so the pyannote backend never imports it. The Hume helpers below all run after this point.
+    global aiohttp
+    import aiohttp
+
+    connector = aiohttp.TCPConnector(limit=MAX_CONNECTIONS)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        return list(await asyncio.gather(*(_analyze_one(session, path) for path in file_paths)))
+
+
+@lru_cache(maxsize=1)
+def _load_diarization_module() -> Any:
+    # torch, pyannote and librosa take seconds to import, so only load them for this backend.
+    # Resolve the sibling script from this file so the import does not depend on sys.path;
+    # the cache keeps one module (and its cached pipeline) per process.
+    module_path = Path(__file__).resolve().parent / "speaker_diarization.py"
+    spec = importlib.util.spec_from_file_location("speaker_diarization", module_path)
+    if spec is None or spec.loader is None:
+        raise ImportError(f"Cannot load diarization module from {module_path}")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _analyze_with_pyannote(file_paths: Sequence[str]) -> List[Dict[str, Any]]:
+    results: List[Dict[str, Any]] = []
+    for file_path in file_paths:
+        try:
+            # Loading inside the try turns a missing torch/pyannote/librosa into an error result.
+            diarization = _load_diarization_module()
+            results.append(diarization.analyze(file_path))
+        except Exception as exc:
+            results.append(
+                {
+                    "speakers": {},
+                    "segments": [],
+                    "error": str(exc),
+                    "traceback": traceback.format_exc(),
+                }
+            )
+    return results
+
+
+def analyze_many(file_paths: Sequence[str], backend: Backend = "hume") -> List[Dict[str, Any]]:
+    if backend == "hume":
+        return asyncio.run(analyze_audio_batch(file_paths))
+    if backend == "pyannote":
+        return _analyze_with_pyannote(file_paths)
+    raise ValueError(f"Unknown analysis backend: {backend}")
+
+
+def analyze(file_path: str, backend: Backend = "hume") -> Dict[str, Any]:
+    return analyze_many([file_path], backend)[0]
+
+
+def analyze_audio(file_path: str) -> Dict[str, Any]:
+    return analyze(file_path, "hume")
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description="Analyze speakers and gender in audio files.")
+    parser.add_argument("--backend", choices=BACKENDS, default="hume")
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="accept several paths and always print a JSON list, one result per path",
+    )
+    parser.add_argument("audio_paths", nargs="+", metavar="audio_path")
+    args = parser.parse_args(argv[1:])
+
+    if not args.batch and len(args.audio_paths) != 1:
+        parser.error("pass --batch to analyze more than one file")
+
+    results = analyze_many(args.audio_paths, args.backend)
+    print(orjson.dumps(results if args.batch else results[0]).decode())
+    return 0
+
+
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: analyze_audio.py <audio_path>", file=sys.stderr)
-        sys.exit(1)
-    analysis = analyze_audio(sys.argv[1])
-    print(json.dumps(analysis))
+    sys.exit(main(sys.argv))
@@ -7,8 +7,12 @@ from pydub import AudioSegment, silence
 def analyze_audio(file_path):
     try:
         y, sr = librosa.load(file_path, sr=16000)
-        pitches, _ = librosa.piptrack(y=y, sr=sr)
-        valid_pitches = pitches[pitches > 0]
+        # YIN tracks a single F0 per frame instead of piptrack's (n_freq, n_frames) matrix
+        f0 = librosa.yin(y, fmin=60, fmax=400, sr=sr, frame_length=2048, hop_length=512)
+        # YIN also estimates pauses and noise, so only average frames above the -40 dBFS silence threshold
+        rms = librosa.feature.rms(y=y, frame_length=2048, hop_length=512)[0]
+        voiced = librosa.amplitude_to_db(rms, ref=1.0) > -40
+        valid_pitches = f0[voiced[:len(f0)]]
 
         gender = "unknown"
         if len(valid_pitches) > 0:
@@ -6,12 +6,15 @@ for the TypeScript translation pipeline.
 
 from __future__ import annotations
 
+import heapq
 import json
 import os
-import subprocess
 import sys
 import time
 import wave
+from collections import deque
+from functools import lru_cache
+from operator import itemgetter
 from pathlib import Path
 from typing import Any, Dict, Iterable, List, Optional
 
@@ -22,6 +25,8 @@ from hume.expression_measurement.batch.types.models import Models
 from hume.expression_measurement.batch.types.prosody import Prosody
 from hume.expression_measurement.batch.types.transcription import Transcription
 from hume.expression_measurement.batch.types.union_predict_result import UnionPredictResult
+import orjson
+from pydantic import BaseModel
 
 
 class AnalysisError(Exception):
@@ -40,44 +45,57 @@ def _read_duration_seconds(audio_path: Path) -> Optional[float]:
     return None
 
 
-def _search_for_gender(value: Any) -> Optional[str]:
+_GENDER_KEYS = frozenset({"gender", "speaker_gender", "bio_gender"})
+_GENDER_VALUES = frozenset({"male", "female"})
+
+
+def _fields(value: Any) -> Optional[Dict[str, Any]]:
+    # Pydantic models are read through their attribute dict (plus extras) so nothing is dumped.
     if isinstance(value, dict):
-        for key, val in value.items():
-            if isinstance(key, str) and key.lower() in {"gender", "speaker_gender", "bio_gender"}:
-                if isinstance(val, str):
-                    normalised = val.lower()
-                    if normalised in {"male", "female"}:
-                        return normalised
-            nested = _search_for_gender(val)
-            if nested:
-                return nested
-    elif isinstance(value, list):
-        for item in value:
-            nested = _search_for_gender(item)
-            if nested:
-                return nested
+        return value
+    if isinstance(value, BaseModel):
+        extra = getattr(value, "__pydantic_extra__", None)
+        return {**value.__dict__, **extra} if extra else value.__dict__
     return None
 
 
-def _infer_primary_gender(raw_sections: Iterable[Dict[str, Any]]) -> str:
-    for section in raw_sections:
-        gender = _search_for_gender(section)
+def _search_for_gender(value: Any) -> Optional[str]:
+    # Breadth-first walk with an explicit queue: prediction trees can be deeply nested and large.
+    pending = deque([value])
+    while pending:
+        current = pending.popleft()
+        if isinstance(current, list):
+            pending.extend(item for item in current if isinstance(item, (dict, list, BaseModel)))
+            continue
+        fields = _fields(current)
+        if not fields:
+            continue
+        for key, val in fields.items():
+            if isinstance(key, str) and isinstance(val, str) and key.lower() in _GENDER_KEYS:
+                normalised = val.lower()
+                if normalised in _GENDER_VALUES:
+                    return normalised
+            if isinstance(val, (dict, list, BaseModel)):
+                pending.append(val)
+    return None
+
+
+def _infer_primary_gender(predictions: Iterable[UnionPredictResult]) -> str:
+    for result in predictions:
+        gender = _search_for_gender(result)
         if gender:
             return gender
     return "unknown"
 
 
 def _collect_analysis(predictions: List[UnionPredictResult], duration: Optional[float]) -> Dict[str, Any]:
-    segments: List[Dict[str, Any]] = []
+    # Entries within a group arrive in time order; keep each group as a run and merge at the end.
+    segment_runs: List[List[Dict[str, Any]]] = []
     transcript_parts: List[str] = []
     emotion_overview: List[Dict[str, Any]] = []
-    raw_dump: List[Dict[str, Any]] = []
-
     first_speaker: Optional[str] = None
 
     for result in predictions:
-        raw_dump.append(result.model_dump(exclude_none=True))
-
         if result.error or not result.results:
             continue
 
@@ -92,6 +110,8 @@ def _collect_analysis(predictions: List[UnionPredictResult], duration: Optional[
                 if first_speaker is None:
                     first_speaker = speaker_id
 
+                run: List[Dict[str, Any]] = []
+                segment_runs.append(run)
                 for entry in group.predictions:
                     time_info = getattr(entry, "time", None)
                     start = float(getattr(time_info, "begin", 0.0) or 0.0)
@@ -101,7 +121,7 @@ def _collect_analysis(predictions: List[UnionPredictResult], duration: Optional[
                         for emotion in getattr(entry, "emotions", []) or []
                     ]
 
-                    segments.append(
+                    run.append(
                         {
                             "speaker": speaker_id,
                             "start": start,
@@ -127,6 +147,8 @@ def _collect_analysis(predictions: List[UnionPredictResult], duration: Optional[
                             }
                         )
 
+    segments = list(heapq.merge(*segment_runs, key=itemgetter("start")))
+
     if not segments:
         speaker_id = first_speaker or "speaker_0"
         segments = [
@@ -140,35 +162,38 @@ def _collect_analysis(predictions: List[UnionPredictResult], duration: Optional[
             }
         ]
 
-    segments.sort(key=lambda item: item.get("start", 0.0))
-
     primary_speaker = first_speaker or segments[0]["speaker"]
-    gender = _infer_primary_gender(raw_dump)
+    gender = _infer_primary_gender(predictions)
 
-    return {
+    analysis: Dict[str, Any] = {
         "duration": duration,
         "speakers": {primary_speaker: {"gender": gender}},
         "segments": segments,
         "transcript": " ".join(transcript_parts).strip(),
         "emotions": emotion_overview,
-        "raw": raw_dump,
     }
+    if _debug_enabled():
+        analysis["raw"] = [result.model_dump(exclude_none=True) for result in predictions]
+    return analysis
+
+
+# The job configuration never changes, so validate and serialise it once at import time.
+_REQUEST_JSON: Dict[str, Any] = InferenceBaseRequest(
+    models=Models(
+        prosody=Prosody(identify_speakers=True),
+    ),
+    transcription=Transcription(identify_speakers=True),
+).model_dump(mode="json", exclude_none=True)
 
 
 def _start_job(client: HumeClient, audio_path: Path) -> str:
-    request = InferenceBaseRequest(
-        models=Models(
-            prosody=Prosody(identify_speakers=True),
-        ),
-        transcription=Transcription(identify_speakers=True),
-    )
     file_name = audio_path.name or "audio.wav"
     mime_type = _guess_mime(audio_path)
     with audio_path.open("rb") as audio_file:
         file_tuple = (file_name, audio_file, mime_type)
         return client.expression_measurement.batch.start_inference_job_from_local_file(
             file=[file_tuple],
-            json=request.model_dump(mode="json", exclude_none=True),
+            json=_REQUEST_JSON,
         )
 
 
@@ -187,43 +212,42 @@ def _guess_mime(audio_path: Path) -> str:
     return "application/octet-stream"
 
 
-def _log_ffprobe(audio_path: Path) -> None:
+def _debug_enabled() -> bool:
+    return os.getenv("HUME_DEBUG") == "1"
+
+
+def _log_audio_info(audio_path: Path) -> None:
     try:
         size_bytes = audio_path.stat().st_size
         print(f"[hume_analyze] audio file: path={audio_path} size_bytes={size_bytes}", file=sys.stderr)
     except Exception as exc:  # pragma: no cover - diagnostics only
         print(f"[hume_analyze] failed to stat audio file: {exc}", file=sys.stderr)
 
+    # Read the WAV header in-process instead of forking ffprobe.
     try:
-        result = subprocess.run(
-            [
-                "ffprobe",
-                "-v",
-                "error",
-                "-show_streams",
-                "-show_format",
-                str(audio_path),
-            ],
-            capture_output=True,
-            text=True,
-            check=False,
+        with wave.open(str(audio_path), "rb") as wav:
+            rate = wav.getframerate()
+            channels = wav.getnchannels()
+            duration = wav.getnframes() / float(rate) if rate else None
+        print(
+            f"[hume_analyze] wav header: rate={rate} channels={channels} duration={duration}",
+            file=sys.stderr,
         )
-        stdout = (result.stdout or "").strip()
-        stderr = (result.stderr or "").strip()
-        if stdout:
-            preview = stdout if len(stdout) <= 2000 else stdout[:2000] + "..."
-            print(f"[hume_analyze] ffprobe stdout:\n{preview}", file=sys.stderr)
-        if stderr:
-            preview_err = stderr if len(stderr) <= 2000 else stderr[:2000] + "..."
-            print(f"[hume_analyze] ffprobe stderr:\n{preview_err}", file=sys.stderr)
-    except FileNotFoundError:
-        print("[hume_analyze] ffprobe not available in PATH", file=sys.stderr)
-    except Exception as exc:  # pragma: no cover
-        print(f"[hume_analyze] ffprobe invocation failed: {exc}", file=sys.stderr)
-
-
-def _wait_for_completion(client: HumeClient, job_id: str, timeout_seconds: float, poll_seconds: float) -> None:
+    except (wave.Error, EOFError):
+        print("[hume_analyze] audio is not a PCM WAV file; header details unavailable", file=sys.stderr)
+    except Exception as exc:  # pragma: no cover - diagnostics only
+        print(f"[hume_analyze] failed to read audio header: {exc}", file=sys.stderr)
+
+
+def _wait_for_completion(
+    client: HumeClient,
+    job_id: str,
+    timeout_seconds: float,
+    poll_seconds: float,
+    max_poll_seconds: float,
+) -> None:
     deadline = time.time() + timeout_seconds
+    delay = poll_seconds
     while True:
         job = client.expression_measurement.batch.get_job_details(job_id)
         status = getattr(job.state, "status", "").upper()
@@ -232,9 +256,17 @@ def _wait_for_completion(client: HumeClient, job_id: str, timeout_seconds: float
         if status == "FAILED":
             message = getattr(job.state, "message", "Unknown failure")
             raise AnalysisError(f"Hume job failed: {message}")
-        if time.time() >= deadline:
+        remaining = deadline - time.time()
+        if remaining <= 0:
             raise AnalysisError("Timed out waiting for Hume job to complete")
-        time.sleep(poll_seconds)
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 1.5, max_poll_seconds)
+
+
+@lru_cache(maxsize=1)
+def _client(api_key: str) -> HumeClient:
+    # Reuse one client (and its HTTP connection pool) for every job in this process.
+    return HumeClient(api_key=api_key)
 
 
 def _run(audio_path: Path) -> Dict[str, Any]:
@@ -242,14 +274,16 @@ def _run(audio_path: Path) -> Dict[str, Any]:
     if not api_key:
         raise AnalysisError("HUME_API_KEY is not set")
 
-    client = HumeClient(api_key=api_key)
+    client = _client(api_key)
 
-    _log_ffprobe(audio_path)
+    if _debug_enabled():
+        _log_audio_info(audio_path)
 
     job_id = _start_job(client, audio_path)
     timeout_seconds = float(os.getenv("HUME_ANALYZE_TIMEOUT", "180"))
-    poll_seconds = float(os.getenv("HUME_ANALYZE_POLL_SECONDS", "1.5"))
-    _wait_for_completion(client, job_id, timeout_seconds, poll_seconds)
+    poll_seconds = float(os.getenv("HUME_ANALYZE_POLL_SECONDS", "1.0"))
+    max_poll_seconds = float(os.getenv("HUME_ANALYZE_POLL_MAX_SECONDS", "15"))
+    _wait_for_completion(client, job_id, timeout_seconds, poll_seconds, max_poll_seconds)
 
     predictions = client.expression_measurement.batch.get_job_predictions(job_id)
     duration = _read_duration_seconds(audio_path)
@@ -282,7 +316,8 @@ def main(argv: List[str]) -> int:
         print(json.dumps({"error": "Unexpected failure", "details": str(exc)}))
         return 4
 
-    print(json.dumps(analysis))
+    # Segment and emotion lists grow with clip length; orjson encodes them much faster than json.
+    print(orjson.dumps(analysis).decode())
     return 0
 
 
@@ -5,64 +5,195 @@ Speaker Diarization and Gender Analysis Script
 Возвращает JSON с информацией о спикерах и их речевых сегментах.
 """
 
+import math
+import os
 import sys
 import json
 import librosa
 import numpy as np
-from typing import Dict, List, Any
-from pydub import AudioSegment
+import soundfile as sf
+from functools import lru_cache
+from typing import Dict, List, Any, Tuple
 
 try:
+    import torch
+    import torchaudio
     from pyannote.audio import Pipeline
     PYANNOTE_AVAILABLE = True
 except ImportError:
     PYANNOTE_AVAILABLE = False
 
-def detect_gender_from_pitch(audio_segment: AudioSegment, start_time: float, end_time: float) -> str:
+PIPELINE_MODEL_ID = "pyannote/speaker-diarization-3.1"
+
+# pyannote/speaker-diarization-3.1 работает с моно-аудио 16 кГц
+PIPELINE_SAMPLE_RATE = 16000
+
+# Диапазон поиска F0 для речи и шаг кадра при оценке высоты тона
+PITCH_FMIN = 60
+PITCH_FMAX = 400
+PITCH_FRAME_TIME = 0.02
+PITCH_FRAME_LENGTH = 2048
+PITCH_HOP_LENGTH = 512
+
+# Кадры тише этого уровня (паузы, шум) не учитываются при оценке F0
+PITCH_SILENCE_DB = -40
+
+# Для пола достаточно короткого фрагмента речи; 8 кГц хватает для оценки F0
+PITCH_WINDOW_SECONDS = 3.0
+PITCH_SAMPLE_RATE = 8000
+
+def load_waveform(audio_path: str) -> "torch.Tensor":
+    """
+    Загружает аудио один раз в тензор (1, T): моно, 16 кГц.
+    Тот же тензор используется и для diarization, и для определения пола.
+    """
+    waveform, sample_rate = torchaudio.load(audio_path)
+    if waveform.shape[0] > 1:
+        waveform = waveform.mean(0, keepdim=True)
+    if sample_rate != PIPELINE_SAMPLE_RATE:
+        waveform = torchaudio.functional.resample(waveform, sample_rate, PIPELINE_SAMPLE_RATE)
+    return waveform
+
+def select_device() -> "torch.device":
+    """
+    Выбирает CUDA, если доступна, иначе CPU.
+    """
+    return torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+@lru_cache(maxsize=1)
+def load_pipeline(model_id: str = PIPELINE_MODEL_ID, compile_segmentation: bool = False) -> "Pipeline":
+    """
+    Загружает pipeline один раз на процесс: веса и инициализация моделей
+    дороже, чем сама diarization коротких клипов.
+    compile_segmentation включает torch.compile — окупается только в --serve.
     """
-    Определяет пол спикера на основе анализа высоты тона (F0).
+    pipeline = Pipeline.from_pretrained(model_id, use_auth_token=os.environ.get("HF_TOKEN"))
+    device = select_device()
+    pipeline.to(device)
+    # В долгоживущем воркере на GPU компилируем модель сегментации: окна фиксированной
+    # длины, поэтому граф компилируется один раз и переиспользуется для всех клипов
+    # (pyannote.audio 3.1 хранит сеть в Inference.model; скомпилированный модуль
+    # проксирует атрибуты вроде specifications к исходной модели)
+    segmentation = getattr(pipeline, "_segmentation", None)
+    if (
+        compile_segmentation
+        and device.type == "cuda"
+        and hasattr(torch, "compile")
+        and hasattr(segmentation, "model")
+    ):
+        segmentation.model = torch.compile(segmentation.model)
+    return pipeline
+
+def gender_from_pitch(avg_pitch: float) -> str:
+    """
+    Переводит среднюю высоту тона (Гц) в пол спикера.
+    """
+    if not np.isfinite(avg_pitch) or avg_pitch <= 0:
+        return "unknown"
+    # Мужские голоса обычно ниже 165 Гц, женские выше
+    return "male" if avg_pitch < 165 else "female"
+
+def pitch_window(start_time: float, end_time: float) -> Tuple[float, float]:
+    """
+    Сужает сегмент до центрального окна PITCH_WINDOW_SECONDS.
+    """
+    duration = end_time - start_time
+    if duration <= PITCH_WINDOW_SECONDS:
+        return start_time, end_time
+    start_time += (duration - PITCH_WINDOW_SECONDS) / 2
+    return start_time, start_time + PITCH_WINDOW_SECONDS
+
+def detect_gender_from_pitch(samples: np.ndarray, sample_rate: int, start_time: float, end_time: float) -> str:
+    """
+    Определяет пол спикера на основе анализа высоты тона (F0) на CPU.
+    samples — моно-сигнал в виде numpy-массива.
     """
     try:
-        # Извлекаем сегмент аудио
-        start_ms = int(start_time * 1000)
-        end_ms = int(end_time * 1000)
-        segment = audio_segment[start_ms:end_ms]
+        # Берём срез центральной части сегмента без копирования
+        start_time, end_time = pitch_window(start_time, end_time)
+        audio_data = samples[int(start_time * sample_rate):int(end_time * sample_rate)]
+        audio_data = librosa.resample(audio_data, orig_sr=sample_rate, target_sr=PITCH_SAMPLE_RATE)
         
-        # Конвертируем в numpy array для librosa
-        audio_data = np.array(segment.get_array_of_samples())
-        if segment.channels == 2:
-            audio_data = audio_data.reshape((-1, 2)).mean(axis=1)
-        
-        # Анализируем высоту тона
-        pitches, _ = librosa.piptrack(y=audio_data, sr=segment.frame_rate)
-        valid_pitches = pitches[pitches > 0]
-        
-        if len(valid_pitches) == 0:
+        # YIN заметно дешевле pYIN/piptrack и не строит матрицу (n_freq, T)
+        f0 = librosa.yin(
+            audio_data,
+            fmin=PITCH_FMIN,
+            fmax=PITCH_FMAX,
+            sr=PITCH_SAMPLE_RATE,
+            frame_length=PITCH_FRAME_LENGTH,
+            hop_length=PITCH_HOP_LENGTH,
+        )
+        # YIN оценивает каждый кадр, включая паузы — оставляем только громкие кадры
+        rms = librosa.feature.rms(y=audio_data, frame_length=PITCH_FRAME_LENGTH, hop_length=PITCH_HOP_LENGTH)[0]
+        voiced = librosa.amplitude_to_db(rms, ref=1.0) > PITCH_SILENCE_DB
+        voiced_f0 = f0[voiced[:len(f0)]]
+        if len(voiced_f0) == 0:
             return "unknown"
-        
-        avg_pitch = np.mean(valid_pitches)
-        # Мужские голоса обычно ниже 165 Гц, женские выше
-        return "male" if avg_pitch < 165 else "female"
+        return gender_from_pitch(float(np.mean(voiced_f0)))
         
     except Exception:
         return "unknown"
 
-def analyze_with_pyannote(audio_path: str) -> Dict[str, Any]:
+def detect_genders_batched(
+    waveform: "torch.Tensor",
+    sample_rate: int,
+    turns: List[Tuple[float, float]],
+    device: "torch.device",
+) -> List[str]:
+    """
+    Определяет пол сразу для всех спикеров одним батчем на GPU.
+    waveform — тензор (1, T), turns — по одному сегменту (start, end) на спикера;
+    анализируется центральное окно каждого сегмента после понижения до 8 кГц.
+    """
+    try:
+        windows = [pitch_window(start, end) for start, end in turns]
+        slices = [waveform[0, int(start * sample_rate):int(end * sample_rate)] for start, end in windows]
+        batch = torch.nn.utils.rnn.pad_sequence(slices, batch_first=True).to(device)
+        with torch.inference_mode():
+            batch = torchaudio.functional.resample(batch, sample_rate, PITCH_SAMPLE_RATE)
+            f0 = torchaudio.functional.detect_pitch_frequency(
+                batch,
+                PITCH_SAMPLE_RATE,
+                frame_time=PITCH_FRAME_TIME,
+                freq_low=PITCH_FMIN,
+                freq_high=PITCH_FMAX,
+            )
+            # Кадры, попавшие в паддинг, не должны влиять на среднее
+            frame_size = int(math.ceil(PITCH_SAMPLE_RATE * PITCH_FRAME_TIME))
+            valid_frames = torch.tensor(
+                [len(item) * PITCH_SAMPLE_RATE // sample_rate // frame_size for item in slices],
+                device=f0.device,
+            )
+            padding = torch.arange(f0.shape[-1], device=f0.device)[None, :] >= valid_frames[:, None]
+            # Как и на CPU, паузы и шум ниже порога тишины не учитываем
+            n_frames = f0.shape[-1]
+            frames = torch.nn.functional.pad(batch, (0, n_frames * frame_size - batch.shape[-1]))
+            frame_rms = frames.reshape(batch.shape[0], n_frames, frame_size).pow(2).mean(dim=-1).sqrt()
+            silent = 20 * torch.log10(frame_rms.clamp_min(1e-10)) <= PITCH_SILENCE_DB
+            avg_pitches = f0.masked_fill(padding | silent, float("nan")).nanmean(dim=1).tolist()
+        return [gender_from_pitch(avg_pitch) for avg_pitch in avg_pitches]
+    except Exception:
+        return ["unknown"] * len(turns)
+
+def analyze_with_pyannote(audio_path: str, compile_segmentation: bool = False) -> Dict[str, Any]:
     """
     Анализ с использованием pyannote.audio для speaker diarization.
     """
     try:
-        # Инициализируем pipeline для speaker diarization
-        pipeline = Pipeline.from_pretrained("pyannote/speaker-diarization-3.1")
+        # Берём закэшированный pipeline для speaker diarization
+        pipeline = load_pipeline(compile_segmentation=compile_segmentation)
+        device = select_device()
         
-        # Загружаем аудио
-        audio = AudioSegment.from_wav(audio_path)
+        # Загружаем аудио один раз и передаём pipeline готовый тензор
+        waveform = load_waveform(audio_path)
+        samples = waveform[0].numpy()
         
-        # Выполняем diarization
-        diarization = pipeline(audio_path)
+        # Выполняем diarization в fp32: fbank эмбеддингов переполняет fp16
+        with torch.inference_mode():
+            diarization = pipeline({"waveform": waveform, "sample_rate": PIPELINE_SAMPLE_RATE})
         
-        # Собираем информацию о спикерах
-        speakers_info = {}
+        # Собираем сегменты и по одному сегменту каждого спикера для анализа пола
+        speaker_turns: Dict[str, Tuple[float, float]] = {}
         segments = []
         
         for turn, _, speaker in diarization.itertracks(yield_label=True):
@@ -70,10 +201,10 @@ def analyze_with_pyannote(audio_path: str) -> Dict[str, Any]:
             start_time = turn.start
             end_time = turn.end
             
-            # Если это первый сегмент спикера, определяем пол
-            if speaker_id not in speakers_info:
-                gender = detect_gender_from_pitch(audio, start_time, end_time)
-                speakers_info[speaker_id] = {"gender": gender}
+            # Для определения пола берём самый длинный сегмент спикера
+            longest = speaker_turns.get(speaker_id)
+            if longest is None or end_time - start_time > longest[1] - longest[0]:
+                speaker_turns[speaker_id] = (start_time, end_time)
             
             segments.append({
                 "speaker": speaker_id,
@@ -81,6 +212,19 @@ def analyze_with_pyannote(audio_path: str) -> Dict[str, Any]:
                 "end": round(end_time, 2)
             })
         
+        turns = list(speaker_turns.values())
+        if device.type == "cuda":
+            genders = detect_genders_batched(waveform, PIPELINE_SAMPLE_RATE, turns, device)
+        else:
+            genders = [
+                detect_gender_from_pitch(samples, PIPELINE_SAMPLE_RATE, start, end)
+                for start, end in turns
+            ]
+        speakers_info = {
+            speaker_id: {"gender": gender}
+            for speaker_id, gender in zip(speaker_turns, genders)
+        }
+        
         return {
             "speakers": speakers_info,
             "segments": segments
@@ -93,16 +237,32 @@ def analyze_with_pyannote(audio_path: str) -> Dict[str, Any]:
             "segments": []
         }
 
+def longest_voiced_interval(samples: np.ndarray, sample_rate: int, total_duration: float) -> Tuple[float, float]:
+    """
+    Возвращает (start, end) в секундах самого длинного участка громче порога
+    тишины относительно пика; если таких нет — весь файл.
+    """
+    intervals = librosa.effects.split(samples, top_db=-PITCH_SILENCE_DB)
+    if len(intervals) == 0:
+        return 0.0, total_duration
+    start, end = max(intervals, key=lambda interval: interval[1] - interval[0])
+    return start / float(sample_rate), end / float(sample_rate)
+
 def fallback_analysis(audio_path: str) -> Dict[str, Any]:
     """
     Fallback анализ без pyannote - определяем одного спикера для всего аудио.
     """
     try:
-        audio = AudioSegment.from_wav(audio_path)
-        total_duration = len(audio) / 1000.0  # в секундах
+        # Читаем WAV сразу в float32 numpy-массив, без объектов pydub
+        samples, sample_rate = sf.read(audio_path, dtype="float32", always_2d=False)
+        if samples.ndim > 1:
+            samples = samples.mean(axis=1)
+        total_duration = len(samples) / float(sample_rate)  # в секундах
         
-        # Определяем пол для всего аудио
-        gender = detect_gender_from_pitch(audio, 0, total_duration)
+        # Определяем пол по самому длинному озвученному участку: центр файла
+        # может попасть на паузу или музыку
+        start_time, end_time = longest_voiced_interval(samples, sample_rate, total_duration)
+        gender = detect_gender_from_pitch(samples, sample_rate, start_time, end_time)
         
         return {
             "speakers": {
@@ -124,27 +284,65 @@ def fallback_analysis(audio_path: str) -> Dict[str, Any]:
             "segments": []
         }
 
+def analyze(audio_path: str, compile_segmentation: bool = False) -> Dict[str, Any]:
+    """
+    Анализирует один аудиофайл: pyannote, если доступен, иначе fallback.
+    """
+    if PYANNOTE_AVAILABLE:
+        return analyze_with_pyannote(audio_path, compile_segmentation)
+    print("Warning: pyannote.audio not available, using fallback analysis", file=sys.stderr)
+    return fallback_analysis(audio_path)
+
+def serve() -> None:
+    """
+    Режим долгоживущего воркера: читает запросы из stdin построчно
+    (JSON вида {"path": "..."} или просто путь) и пишет по одной строке JSON
+    с результатом в stdout. Pipeline загружается один раз на весь процесс.
+    """
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            request = json.loads(line) if line.startswith("{") else {"path": line}
+            audio_path = request["path"]
+        except (ValueError, KeyError, TypeError):
+            print(json.dumps({
+                "error": f"Invalid request: {line}",
+                "speakers": {},
+                "segments": []
+            }), flush=True)
+            continue
+        try:
+            result = analyze(audio_path, compile_segmentation=True)
+        except Exception as e:
+            result = {
+                "error": f"Analysis failed: {str(e)}",
+                "speakers": {},
+                "segments": []
+            }
+        print(json.dumps(result), flush=True)
+
 def main():
     """
     Основная функция для анализа аудиофайла.
     """
     if len(sys.argv) < 2:
         print(json.dumps({
-            "error": "Usage: python3 speaker_diarization.py <audio_file_path>",
+            "error": "Usage: python3 speaker_diarization.py <audio_file_path> | --serve",
             "speakers": {},
             "segments": []
         }))
         sys.exit(1)
     
+    if sys.argv[1] == "--serve":
+        serve()
+        return
+    
     audio_path = sys.argv[1]
     
     try:
-        # Проверяем доступность pyannote
-        if PYANNOTE_AVAILABLE:
-            result = analyze_with_pyannote(audio_path)
-        else:
-            print("Warning: pyannote.audio not available, using fallback analysis", file=sys.stderr)
-            result = fallback_analysis(audio_path)
+        result = analyze(audio_path)
         
         # Выводим результат в stdout
         print(json.dumps(result, indent=2))
@@ -160,6 +358,3 @@ def main():
 
 if __name__ == "__main__":
     main()
-
-
-